@@ -1,8 +1,8 @@
 import streamlit as st
-import torch
+import numpy as np
 import time
 import io
-from music_generator import MusicGenerator
+from music_generator import MusicGenerator, DEVICE
 from audio_processor import AudioProcessor
 from music_styles import MusicStyles
 from export_manager import ExportManager
@@ -27,8 +27,161 @@ def load_music_styles():
     return MusicStyles()
 
 @st.cache_resource
-def load_export_manager():
-    return ExportManager()
+def load_export_manager(_audio_proc):
+    return ExportManager(audio_processor=_audio_proc)
+
+@st.cache_data(ttl=60)
+def load_recent_music(_exporter, limit, filter_style="All"):
+    """Recent library tracks, optionally filtered by style, cached across reruns"""
+    music_files = _exporter.get_recent_music(limit)
+    if filter_style != "All":
+        music_files = [m for m in music_files if m.get('style') == filter_style]
+    return music_files
+
+# Each entry holds a whole WAV (about 7.7 MB for two minutes), so bound the count too
+@st.cache_data(ttl=300, max_entries=20)
+def load_audio_bytes(filepath):
+    """Read a library track once and serve it from memory on later reruns"""
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+# Decoder steps per streamed chunk (MusicGen produces ~50 steps per second of audio)
+STREAM_PLAY_STEPS = 50
+
+# Minimum seconds between preview refreshes; each refresh re-encodes and
+# re-sends the clip so far
+PREVIEW_INTERVAL = 5.0
+
+def stream_generation(music_gen, audio_proc, player, prompt, style, volume=1.0, fade_in=0.0, **kwargs):
+    """Generate music, updating the player as chunks arrive
+    
+    Returns (audio_array, message, position), where position is roughly how
+    far into the clip the preview has played, or None if no preview was shown.
+    """
+    stream = music_gen.generate_music_stream(
+        prompt, style=style, chunk_tokens=STREAM_PLAY_STEPS, **kwargs
+    )
+    
+    chunks = []
+    last_update = None
+    position = sent_duration = 0.0
+    while True:
+        try:
+            chunk = next(stream)
+        except StopIteration as stop:
+            audio_array, message = stop.value
+            if last_update is None:
+                return audio_array, message, None
+            position = min(position + time.time() - last_update, sent_duration)
+            return audio_array, message, position
+        
+        chunks.append(chunk)
+        now = time.time()
+        if last_update is not None:
+            if now - last_update < PREVIEW_INTERVAL:
+                continue
+            # The preview autoplays, so playback has advanced by the time since
+            # the last refresh, unless it already reached the end of that clip
+            position = min(position + now - last_update, sent_duration)
+        
+        # Only the fade-out needs the finished clip; the fade-in can go on now
+        preview = audio_proc.apply_effects(
+            np.concatenate(chunks),
+            fade_in_duration=fade_in,
+            fade_out_duration=0.0,
+            volume_factor=volume
+        )
+        player.audio(
+            audio_proc.create_audio_buffer(preview),
+            format='audio/wav',
+            start_time=int(position),
+            autoplay=True
+        )
+        sent_duration = len(preview) / audio_proc.sample_rate
+        last_update = now
+
+@st.fragment
+def render_library(exporter, available_styles):
+    """Library tab, rerun on its own so deletes don't re-execute the whole app"""
+    st.header("🎧 Your Music Library")
+    
+    music_files = load_recent_music(exporter, 20)
+    
+    if music_files:
+        st.write(f"📂 Total tracks: {len(music_files)}")
+        
+        # Library controls
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            sort_by = st.selectbox("Sort by", ["Recent", "Style", "Duration"])
+        with col2:
+            filter_style = st.selectbox("Filter by style", ["All"] + available_styles)
+        with col3:
+            if st.button("🗑️ Clear Library"):
+                if st.checkbox("Confirm deletion"):
+                    # Clear library logic here
+                    st.warning("Library cleared!")
+        
+        # Filter music files
+        filtered_files = load_recent_music(exporter, 20, filter_style)
+        
+        # Display music library
+        for i, music in enumerate(filtered_files):
+            with st.container():
+                col1, col2 = st.columns([3, 1])
+                
+                with col1:
+                    try:
+                        st.audio(load_audio_bytes(music['filepath']), format='audio/wav')
+                        
+                        # Music details
+                        st.write(f"**🎵 Prompt:** {music['prompt'][:100]}...")
+                        
+                        details_col1, details_col2, details_col3 = st.columns(3)
+                        with details_col1:
+                            st.write(f"**Style:** {music.get('style', 'N/A')}")
+                        with details_col2:
+                            st.write(f"**Duration:** {music.get('duration', 'N/A')}s")
+                        with details_col3:
+                            st.write(f"**Created:** {music['timestamp']}")
+                    
+                    except Exception as e:
+                        st.error(f"Error loading track: {e}")
+                
+                with col2:
+                    if st.button(f"🗑️ Delete", key=f"delete_{i}"):
+                        if exporter.delete_music_file(music['filepath']):
+                            load_recent_music.clear()
+                            st.success("Track deleted!")
+                            st.rerun(scope="fragment")
+                    
+                    if st.button(f"📋 Details", key=f"details_{i}"):
+                        st.session_state[f"show_details_{i}"] = True
+                
+                # Show detailed metadata if requested
+                if st.session_state.get(f"show_details_{i}", False):
+                    with st.expander("📋 Full Details", expanded=True):
+                        st.json(music)
+                        if st.button("Close", key=f"close_{i}"):
+                            st.session_state[f"show_details_{i}"] = False
+                
+                st.divider()
+    
+    else:
+        st.info("🎵 No music tracks yet! Compose your first piece in the Compose tab.")
+        
+        # Quick start suggestions
+        st.subheader("🚀 Quick Start")
+        quick_prompts = [
+            "A peaceful ambient soundscape",
+            "Upbeat electronic dance music",
+            "Classical piano melody"
+        ]
+        
+        for prompt in quick_prompts:
+            if st.button(f"Generate: {prompt}", key=f"quick_{prompt}"):
+                st.session_state.prompt_suggestion = prompt
+                st.switch_page("Compose")
 
 def main():
     st.title("🎵 AI Music Composer & Producer")
@@ -39,7 +192,7 @@ def main():
         music_gen = load_music_generator()
         audio_proc = load_audio_processor()
         styles = load_music_styles()
-        exporter = load_export_manager()
+        exporter = load_export_manager(audio_proc)
     except Exception as e:
         st.error(f"❌ Failed to initialize: {e}")
         st.stop()
@@ -79,11 +232,17 @@ def main():
         volume_adjust = st.slider("Volume", 0.1, 2.0, 1.0, step=0.1)
         
         # Device info
-        device = "GPU (CUDA)" if torch.cuda.is_available() else "CPU"
+        device = "GPU (CUDA)" if DEVICE == "cuda" else "CPU"
         st.info(f"🖥️ Using: {device}")
         
         if device == "CPU":
             st.warning("⚠️ Using CPU - generation will be slower. Consider using GPU for faster results.")
+        
+        # torch.compile only pays off on the GPU, and the first load compiles for about a minute
+        compile_decoder = DEVICE == "cuda" and st.checkbox(
+            "Compile decoder", value=False,
+            help="Faster generation after a one-off compile when the model loads"
+        )
     
     # Main content tabs
     tab1, tab2, tab3, tab4 = st.tabs(["🎵 Compose", "🎧 Library", "🎼 Quick Prompts", "💡 Tips"])
@@ -148,6 +307,7 @@ def main():
             st.info(f"🎲 Random style selected: {selected_style}")
         
         # Generation logic
+        save_future = None
         if prompt and (generate_music or st.session_state.get('quick_generate', False)):
             if 'quick_generate' in st.session_state:
                 del st.session_state.quick_generate
@@ -170,16 +330,28 @@ def main():
             with st.spinner("🎼 AI is composing your music..."):
                 progress_bar = st.progress(0)
                 status_text = st.empty()
+                player = st.empty()
                 
                 status_text.text("Loading AI model...")
+                if not music_gen.load_model(selected_model, compile_model=compile_decoder):
+                    progress_bar.empty()
+                    status_text.empty()
+                    st.error("❌ Failed to load AI model")
+                    st.stop()
                 progress_bar.progress(0.2)
                 
                 status_text.text("Generating music...")
                 start_time = time.time()
                 
-                audio_array, message = music_gen.generate_with_style(
+                # Stream chunks into the player so playback starts before generation ends
+                audio_array, message, position = stream_generation(
+                    music_gen,
+                    audio_proc,
+                    player,
                     final_prompt, 
                     selected_style, 
+                    volume=volume_adjust,
+                    fade_in=1.0 if add_fade else 0.0,
                     duration=duration,
                     temperature=temperature,
                     top_k=top_k
@@ -192,11 +364,12 @@ def main():
                     status_text.text("Processing audio...")
                     
                     # Apply audio effects
-                    if add_fade:
-                        audio_array = audio_proc.add_fade_effects(audio_array)
-                    
-                    if volume_adjust != 1.0:
-                        audio_array = audio_proc.adjust_volume(audio_array, volume_adjust)
+                    audio_array = audio_proc.apply_effects(
+                        audio_array,
+                        fade_in_duration=1.0 if add_fade else 0.0,
+                        fade_out_duration=2.0 if add_fade else 0.0,
+                        volume_factor=volume_adjust
+                    )
                     
                     progress_bar.progress(1.0)
                     status_text.empty()
@@ -204,12 +377,17 @@ def main():
                     
                     st.success(f"🎉 Music generated in {elapsed:.2f} seconds!")
                     
-                    # Display audio player
+                    # Swap in the finished clip, carrying on from where the preview was playing
                     audio_buffer = audio_proc.create_audio_buffer(audio_array)
-                    st.audio(audio_buffer, format='audio/wav')
+                    if position is None:
+                        player.audio(audio_buffer, format='audio/wav')
+                    else:
+                        player.audio(audio_buffer, format='audio/wav', start_time=int(position), autoplay=True)
                     
                     # Audio information
-                    audio_info = audio_proc.get_audio_info(audio_array)
+                    # Scan for the peak once; info and normalization both use it
+                    peak = audio_proc.get_peak(audio_array)
+                    audio_info = audio_proc.get_audio_info(audio_array, peak=peak)
                     col1, col2, col3 = st.columns(3)
                     with col1:
                         st.metric("Duration", f"{audio_info['duration']}s")
@@ -228,145 +406,84 @@ def main():
                         "generation_time": elapsed
                     }
                     
-                    saved_path = exporter.save_music_file(audio_array, final_prompt, metadata)
+                    save_future = exporter.save_music_file(audio_array, final_prompt, metadata, peak=peak)
                     
-                    if saved_path:
-                        st.success("💾 Music saved to library!")
-                    
-                    # Download options
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.download_button(
-                            label="📥 Download WAV",
-                            data=audio_buffer.getvalue(),
-                            file_name=f"ai_music_{int(time.time())}.wav",
-                            mime="audio/wav"
-                        )
+                    # Encode downloads once; reruns reuse the stored bytes
+                    wav_bytes = audio_buffer.getvalue()
+                    st.session_state.generation_id = st.session_state.get('generation_id', 0) + 1
+                    st.session_state.last_generation = {
+                        "id": st.session_state.generation_id,
+                        "file_stem": f"ai_music_{int(time.time())}",
+                        "wav_bytes": wav_bytes,
+                        "mp3_bytes": audio_proc.convert_to_mp3(wav_bytes)
+                    }
                     
-                    with col2:
-                        # Convert to MP3 for smaller download
-                        try:
-                            import tempfile
-                            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_wav:
-                                audio_proc.save_audio(audio_array, tmp_wav.name)
-                                
-                                with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as tmp_mp3:
-                                    if audio_proc.convert_to_mp3(tmp_wav.name, tmp_mp3.name):
-                                        with open(tmp_mp3.name, 'rb') as f:
-                                            mp3_data = f.read()
-                                        
-                                        st.download_button(
-                                            label="📥 Download MP3",
-                                            data=mp3_data,
-                                            file_name=f"ai_music_{int(time.time())}.mp3",
-                                            mime="audio/mp3"
-                                        )
-                        except Exception as e:
-                            st.warning("MP3 conversion not available")
+                    # The write overlaps the MP3 encode and is reported below the downloads
+                    if save_future is None:
+                        st.error("❌ Failed to save music to library")
                 
                 else:
                     progress_bar.empty()
                     status_text.empty()
+                    player.empty()
                     st.error(f"❌ Failed to generate music: {message}")
-    
-    with tab2:
-        st.header("🎧 Your Music Library")
-        
-        music_files = exporter.get_recent_music(20)
         
-        if music_files:
-            st.write(f"📂 Total tracks: {len(music_files)}")
-            
-            # Library controls
-            col1, col2, col3 = st.columns(3)
+        # Download options for the most recent generation
+        last_generation = st.session_state.get('last_generation')
+        if last_generation:
+            col1, col2 = st.columns(2)
             with col1:
-                sort_by = st.selectbox("Sort by", ["Recent", "Style", "Duration"])
-            with col2:
-                filter_style = st.selectbox("Filter by style", ["All"] + available_styles)
-            with col3:
-                if st.button("🗑️ Clear Library"):
-                    if st.checkbox("Confirm deletion"):
-                        # Clear library logic here
-                        st.warning("Library cleared!")
-            
-            # Filter music files
-            filtered_files = music_files
-            if filter_style != "All":
-                filtered_files = [m for m in music_files if m.get('style') == filter_style]
-            
-            # Display music library
-            for i, music in enumerate(filtered_files):
-                with st.container():
-                    col1, col2 = st.columns([3, 1])
-                    
-                    with col1:
-                        try:
-                            st.audio(music['filepath'])
-                            
-                            # Music details
-                            st.write(f"**🎵 Prompt:** {music['prompt'][:100]}...")
-                            
-                            details_col1, details_col2, details_col3 = st.columns(3)
-                            with details_col1:
-                                st.write(f"**Style:** {music.get('style', 'N/A')}")
-                            with details_col2:
-                                st.write(f"**Duration:** {music.get('duration', 'N/A')}s")
-                            with details_col3:
-                                st.write(f"**Created:** {music['timestamp']}")
-                        
-                        except Exception as e:
-                            st.error(f"Error loading track: {e}")
-                    
-                    with col2:
-                        if st.button(f"🗑️ Delete", key=f"delete_{i}"):
-                            if exporter.delete_music_file(music['filepath']):
-                                st.success("Track deleted!")
-                                st.experimental_rerun()
-                        
-                        if st.button(f"📋 Details", key=f"details_{i}"):
-                            st.session_state[f"show_details_{i}"] = True
-                    
-                    # Show detailed metadata if requested
-                    if st.session_state.get(f"show_details_{i}", False):
-                        with st.expander("📋 Full Details", expanded=True):
-                            st.json(music)
-                            if st.button("Close", key=f"close_{i}"):
-                                st.session_state[f"show_details_{i}"] = False
-                    
-                    st.divider()
-        
-        else:
-            st.info("🎵 No music tracks yet! Compose your first piece in the Compose tab.")
-            
-            # Quick start suggestions
-            st.subheader("🚀 Quick Start")
-            quick_prompts = [
-                "A peaceful ambient soundscape",
-                "Upbeat electronic dance music",
-                "Classical piano melody"
-            ]
+                st.download_button(
+                    label="📥 Download WAV",
+                    data=last_generation["wav_bytes"],
+                    file_name=f"{last_generation['file_stem']}.wav",
+                    mime="audio/wav",
+                    key=f"download_wav_{last_generation['id']}"
+                )
             
-            for prompt in quick_prompts:
-                if st.button(f"Generate: {prompt}", key=f"quick_{prompt}"):
-                    st.session_state.prompt_suggestion = prompt
-                    st.switch_page("Compose")
+            with col2:
+                # MP3 for smaller download
+                if last_generation["mp3_bytes"]:
+                    st.download_button(
+                        label="📥 Download MP3",
+                        data=last_generation["mp3_bytes"],
+                        file_name=f"{last_generation['file_stem']}.mp3",
+                        mime="audio/mp3",
+                        key=f"download_mp3_{last_generation['id']}"
+                    )
+                else:
+                    st.warning("MP3 conversion not available")
+        
+        # Wait for the library save only once the downloads are on screen
+        if save_future is not None:
+            if save_future.result():
+                load_recent_music.clear()
+                st.success("💾 Music saved to library!")
+            else:
+                st.error("❌ Failed to save music to library")
     
+    with tab2:
+        render_library(exporter, available_styles)
+
     with tab3:
         st.header("🎼 Quick Prompt Generator")
         
         st.markdown("**Generate music prompts quickly by selecting options:**")
         
+        mood_suggestions = styles.get_mood_suggestions()
+        instrument_suggestions = styles.get_instrument_suggestions()
+        
         # Quick prompt builder
         col1, col2, col3 = st.columns(3)
         
         with col1:
             st.subheader("🎭 Mood")
-            moods = list(styles.get_mood_suggestions().keys())
+            moods = list(mood_suggestions.keys())
             selected_mood = st.selectbox("Choose mood", moods)
         
         with col2:
             st.subheader("🎸 Instruments")
-            instruments = list(styles.get_instrument_suggestions().keys())
+            instruments = list(instrument_suggestions.keys())
             selected_instrument = st.selectbox("Choose instrument", instruments)
         
         with col3:
@@ -375,8 +492,8 @@ def main():
         
         # Generate prompt
         if st.button("🎯 Generate Prompt"):
-            mood_desc = styles.get_mood_suggestions()[selected_mood]
-            instrument_desc = styles.get_instrument_suggestions()[selected_instrument]
+            mood_desc = mood_suggestions[selected_mood]
+            instrument_desc = instrument_suggestions[selected_instrument]
             
             generated_prompt = f"A {selected_mood.lower()} {selected_genre} piece with {selected_instrument.lower()}, {mood_desc}, {instrument_desc}"
             
@@ -414,16 +531,24 @@ def main():
             ]
         }
         
-        for category, prompts in prompt_categories.items():
-            with st.expander(category):
-                for prompt in prompts:
-                    col1, col2 = st.columns([4, 1])
-                    with col1:
-                        st.write(f"• {prompt}")
-                    with col2:
-                        if st.button("Use", key=f"use_{prompt[:20]}"):
-                            st.session_state.prompt_suggestion = prompt
-                            st.success("Prompt copied!")
+        # One selectbox instead of a button per example keeps widget count low
+        flat_prompts = [
+            (category, prompt)
+            for category, prompts in prompt_categories.items()
+            for prompt in prompts
+        ]
+        
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            choice = st.selectbox(
+                "Choose a prompt",
+                flat_prompts,
+                format_func=lambda item: f"{item[0]} • {item[1]}"
+            )
+        with col2:
+            if st.button("Use", key="use_example_prompt"):
+                st.session_state.prompt_suggestion = choice[1]
+                st.success("Prompt copied!")
     
     with tab4:
         st.header("💡 Tips for Better Music Generation")
@@ -1,16 +1,52 @@
 import numpy as np
 import librosa
 import soundfile as sf
-from pydub import AudioSegment
 import io
 import os
+import struct
+import subprocess
+
+
+def _peak(audio_array):
+    """Return the maximum absolute sample value"""
+    # max/min avoid the temporary array that np.abs would allocate
+    return float(max(audio_array.max(), -audio_array.min())) if audio_array.size else 0.0
+
+def _normalized(audio_array, peak=None):
+    """Return float32 audio scaled to a peak of 1.0, leaving the input untouched"""
+    if peak is None:
+        peak = _peak(audio_array)
+    if peak > 0:
+        # Scaling and the float32 cast share one output array
+        return np.multiply(audio_array, 1.0 / peak, dtype=np.float32)
+    return np.ascontiguousarray(audio_array, dtype=np.float32)
+
+def _wav_bytes(audio_array, sample_rate):
+    """Encode mono float audio as a 16-bit PCM WAV in memory"""
+    pcm = np.clip(audio_array, -1.0, 1.0).astype(np.float32, copy=False)
+    pcm = (pcm * 32767).astype('<i2')
+    data_size = pcm.size * 2
+    
+    header = struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b'data', data_size
+    )
+    
+    buffer = io.BytesIO()
+    buffer.write(header)
+    buffer.write(pcm.data)
+    buffer.seek(0)
+    return buffer
 
 class AudioProcessor:
     def __init__(self):
         self.sample_rate = 32000
+        self._fade_cache = {}
         
-    def save_audio(self, audio_array, filename, sample_rate=None):
-        """Save audio array to file"""
+    def save_audio(self, audio_array, filename, sample_rate=None, peak=None):
+        """Save audio array to file, reusing a known peak for normalization"""
         if sample_rate is None:
             sample_rate = self.sample_rate
             
@@ -19,8 +55,8 @@ class AudioProcessor:
             if audio_array.ndim > 1:
                 audio_array = audio_array[0]  # Take first channel if stereo
             
-            # Normalize audio
-            audio_array = audio_array / np.max(np.abs(audio_array))
+            # Normalize audio into a new array; the caller may still be using theirs
+            audio_array = _normalized(audio_array, peak)
             
             # Save as WAV file
             sf.write(filename, audio_array, sample_rate)
@@ -30,15 +66,21 @@ class AudioProcessor:
             print(f"Error saving audio: {e}")
             return False
     
-    def convert_to_mp3(self, wav_file, mp3_file):
-        """Convert WAV to MP3"""
+    def convert_to_mp3(self, wav_bytes):
+        """Convert WAV bytes to MP3 bytes by piping through ffmpeg"""
         try:
-            audio = AudioSegment.from_wav(wav_file)
-            audio.export(mp3_file, format="mp3")
-            return True
+            result = subprocess.run(
+                ["ffmpeg", "-f", "wav", "-i", "pipe:0",
+                 "-f", "mp3", "-codec:a", "libmp3lame", "-q:a", "5",
+                 "-ac", "1", "-ar", str(self.sample_rate), "pipe:1"],
+                input=wav_bytes,
+                capture_output=True,
+                check=True
+            )
+            return result.stdout
         except Exception as e:
             print(f"Error converting to MP3: {e}")
-            return False
+            return None
     
     def add_fade_effects(self, audio_array, fade_in_duration=1.0, fade_out_duration=2.0):
         """Add fade in and fade out effects"""
@@ -46,17 +88,19 @@ class AudioProcessor:
             fade_in_samples = int(fade_in_duration * self.sample_rate)
             fade_out_samples = int(fade_out_duration * self.sample_rate)
             
-            # Create fade curves
-            fade_in = np.linspace(0, 1, fade_in_samples)
-            fade_out = np.linspace(1, 0, fade_out_samples)
+            # Work on a contiguous float32 buffer so the fades can be applied in place
+            audio_array = np.ascontiguousarray(audio_array, dtype=np.float32)
+            fade_in, fade_out = self._get_fade_curves(fade_in_samples, fade_out_samples)
             
             # Apply fade in
             if len(audio_array) > fade_in_samples:
-                audio_array[:fade_in_samples] *= fade_in
+                head = audio_array[:fade_in_samples]
+                np.multiply(head, fade_in, out=head)
             
             # Apply fade out
             if len(audio_array) > fade_out_samples:
-                audio_array[-fade_out_samples:] *= fade_out
+                tail = audio_array[len(audio_array) - fade_out_samples:]
+                np.multiply(tail, fade_out, out=tail)
             
             return audio_array
             
@@ -64,14 +108,70 @@ class AudioProcessor:
             print(f"Error adding fade effects: {e}")
             return audio_array
     
+    def _get_fade_curves(self, fade_in_samples, fade_out_samples, volume_factor=1.0):
+        """Return cached fade in/out envelopes for the given lengths and volume"""
+        key = (fade_in_samples, fade_out_samples, volume_factor)
+        curves = self._fade_cache.get(key)
+        if curves is None:
+            fade_in = np.linspace(0, volume_factor, fade_in_samples, dtype=np.float32)
+            fade_out = np.linspace(volume_factor, 0, fade_out_samples, dtype=np.float32)
+            curves = self._fade_cache[key] = (fade_in, fade_out)
+        return curves
+    
+    def apply_effects(self, audio_array, fade_in_duration=1.0, fade_out_duration=2.0, volume_factor=1.0):
+        """Apply fades and volume in a single pass over the audio"""
+        try:
+            fade_in_samples = int(fade_in_duration * self.sample_rate)
+            fade_out_samples = int(fade_out_duration * self.sample_rate)
+            
+            audio_array = np.ascontiguousarray(audio_array, dtype=np.float32)
+            n = len(audio_array)
+            
+            # Match add_fade_effects: fades longer than the clip are skipped
+            if n <= fade_in_samples:
+                fade_in_samples = 0
+            if n <= fade_out_samples:
+                fade_out_samples = 0
+            
+            # Overlapping fades multiply each other, so apply them one after another
+            if fade_in_samples + fade_out_samples > n:
+                audio_array = self.add_fade_effects(audio_array, fade_in_duration, fade_out_duration)
+                return self.adjust_volume(audio_array, volume_factor)
+            
+            # Volume is folded into the envelopes so each sample is written once
+            fade_in, fade_out = self._get_fade_curves(fade_in_samples, fade_out_samples, volume_factor)
+            
+            head = audio_array[:fade_in_samples]
+            np.multiply(head, fade_in, out=head)
+            
+            if volume_factor != 1.0:
+                body = audio_array[fade_in_samples:n - fade_out_samples]
+                np.multiply(body, volume_factor, out=body)
+            
+            tail = audio_array[n - fade_out_samples:]
+            np.multiply(tail, fade_out, out=tail)
+            
+            return audio_array
+            
+        except Exception as e:
+            print(f"Error applying audio effects: {e}")
+            return audio_array
+    
     def adjust_volume(self, audio_array, volume_factor=1.0):
-        """Adjust audio volume"""
-        return audio_array * volume_factor
+        """Adjust audio volume, scaling in place when the array allows it"""
+        if volume_factor == 1.0:
+            return audio_array
+        in_place = audio_array.flags.writeable and np.issubdtype(audio_array.dtype, np.floating)
+        return np.multiply(audio_array, volume_factor, out=audio_array if in_place else None)
+    
+    def get_peak(self, audio_array):
+        """Get the peak amplitude so it can be shared by info and saving"""
+        return _peak(audio_array)
     
-    def get_audio_info(self, audio_array):
+    def get_audio_info(self, audio_array, peak=None):
         """Get information about audio"""
         duration = len(audio_array) / self.sample_rate
-        max_amplitude = np.max(np.abs(audio_array))
+        max_amplitude = _peak(audio_array) if peak is None else peak
         
         return {
             "duration": round(duration, 2),
@@ -82,7 +182,4 @@ class AudioProcessor:
     
     def create_audio_buffer(self, audio_array):
         """Create audio buffer for download"""
-        buffer = io.BytesIO()
-        sf.write(buffer, audio_array, self.sample_rate, format='WAV')
-        buffer.seek(0)
-        return buffer
+        return _wav_bytes(audio_array, self.sample_rate)
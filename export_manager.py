@@ -1,89 +1,193 @@
 import os
 import json
+import sqlite3
+import threading
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 import shutil
 
+TRACK_COLUMNS = [
+    "filename", "prompt", "style", "duration", "temperature", "top_k",
+    "model", "generation_time", "timestamp", "filepath", "file_size"
+]
+INSERT_TRACK_SQL = (
+    f"INSERT OR REPLACE INTO tracks ({', '.join(TRACK_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in TRACK_COLUMNS)})"
+)
+
 class ExportManager:
-    def __init__(self, export_path="generated_music"):
+    def __init__(self, export_path="generated_music", audio_processor=None):
         self.export_path = export_path
-        self.metadata_file = os.path.join(export_path, "music_metadata.json")
+        self._audio_processor = audio_processor
+        self.metadata_db = os.path.join(export_path, "metadata.db")
+        self.legacy_metadata_file = os.path.join(export_path, "music_metadata.json")
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        self._pending_writes = []
+        self._pending_lock = threading.Lock()
         self.ensure_export_directory()
+        self.ensure_metadata_db()
         
     def ensure_export_directory(self):
         """Create export directory if it doesn't exist"""
         if not os.path.exists(self.export_path):
             os.makedirs(self.export_path)
     
-    def save_music_file(self, audio_array, prompt, metadata=None):
-        """Save generated music with metadata"""
+    @property
+    def audio_processor(self):
+        """Shared AudioProcessor, created on first use if none was given"""
+        if self._audio_processor is None:
+            from audio_processor import AudioProcessor
+            self._audio_processor = AudioProcessor()
+        return self._audio_processor
+    
+    def _connect(self):
+        """Open a connection to the metadata database"""
+        conn = sqlite3.connect(self.metadata_db)
+        conn.row_factory = sqlite3.Row
+        # With WAL, NORMAL only fsyncs at checkpoints rather than on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    
+    def ensure_metadata_db(self):
+        """Create the tracks table and indices, importing any legacy JSON metadata"""
+        try:
+            # The connection's own context manager only commits or rolls back;
+            # closing() makes sure it is closed as well, even on errors
+            with closing(self._connect()) as conn, conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    """CREATE TABLE IF NOT EXISTS tracks (
+                        filename TEXT PRIMARY KEY,
+                        prompt TEXT,
+                        style TEXT,
+                        duration REAL,
+                        temperature REAL,
+                        top_k INTEGER,
+                        model TEXT,
+                        generation_time REAL,
+                        timestamp TEXT,
+                        filepath TEXT,
+                        file_size INTEGER
+                    )"""
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_ts ON tracks(timestamp DESC)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_style ON tracks(style)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_filepath ON tracks(filepath)")
+            
+            if os.path.exists(self.legacy_metadata_file):
+                with open(self.legacy_metadata_file, 'r') as f:
+                    legacy_metadata = json.load(f)
+                # Import everything in one transaction
+                with closing(self._connect()) as conn, conn:
+                    conn.executemany(
+                        INSERT_TRACK_SQL,
+                        [[m.get(column) for column in TRACK_COLUMNS] for m in legacy_metadata]
+                    )
+                os.rename(self.legacy_metadata_file, self.legacy_metadata_file + ".imported")
+                
+        except Exception as e:
+            print(f"Error initializing metadata database: {e}")
+    
+    def save_music_file(self, audio_array, prompt, metadata=None, peak=None):
+        """Save generated music with metadata, returning a future for the saved path"""
         try:
             # Generate unique filename
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"music_{timestamp}.wav"
             filepath = os.path.join(self.export_path, filename)
             
-            # Save audio file using audio processor
-            from audio_processor import AudioProcessor
-            processor = AudioProcessor()
+            music_metadata = {
+                "filename": filename,
+                "prompt": prompt,
+                "timestamp": timestamp,
+                "filepath": filepath
+            }
             
-            if processor.save_audio(audio_array, filepath):
-                # Save metadata
-                music_metadata = {
-                    "filename": filename,
-                    "prompt": prompt,
-                    "timestamp": timestamp,
-                    "filepath": filepath,
-                    "file_size": os.path.getsize(filepath)
-                }
-                
-                if metadata:
-                    music_metadata.update(metadata)
+            if metadata:
+                music_metadata.update(metadata)
+            
+            # Write the file and register it in the background so the UI isn't
+            # blocked on the disk flush. save_audio doesn't modify the array,
+            # so the worker can share it with the caller
+            processor = self.audio_processor
+            future = self._io_pool.submit(
+                self._write_and_register, processor, audio_array, filepath, music_metadata, peak
+            )
+            with self._pending_lock:
+                self._pending_writes.append(future)
+            return future
                 
-                self.save_metadata(music_metadata)
-                return filepath
+        except Exception as e:
+            print(f"Error saving music file: {e}")
+            return None
+    
+    def _write_and_register(self, processor, audio_array, filepath, music_metadata, peak=None):
+        """Write audio to disk and save its metadata, returning the path or None"""
+        try:
+            # Save audio file using audio processor
+            if processor.save_audio(audio_array, filepath, peak=peak):
+                music_metadata["file_size"] = os.path.getsize(filepath)
+                if self.save_metadata(music_metadata):
+                    return filepath
             else:
-                return None
+                print(f"Error saving music file: could not write {filepath}")
                 
         except Exception as e:
             print(f"Error saving music file: {e}")
-            return None
+        return None
+    
+    def wait_for_pending_writes(self):
+        """Block until background saves have finished"""
+        with self._pending_lock:
+            pending, self._pending_writes = self._pending_writes, []
+        wait(pending)
     
     def save_metadata(self, music_metadata):
-        """Save music metadata to JSON file"""
+        """Save music metadata to the database"""
         try:
-            # Load existing metadata
-            if os.path.exists(self.metadata_file):
-                with open(self.metadata_file, 'r') as f:
-                    all_metadata = json.load(f)
-            else:
-                all_metadata = []
-            
-            # Add new metadata
-            all_metadata.append(music_metadata)
-            
-            # Save updated metadata
-            with open(self.metadata_file, 'w') as f:
-                json.dump(all_metadata, f, indent=2)
+            values = [music_metadata.get(column) for column in TRACK_COLUMNS]
+            with closing(self._connect()) as conn, conn:
+                conn.execute(INSERT_TRACK_SQL, values)
+            return True
                 
         except Exception as e:
             print(f"Error saving metadata: {e}")
+            return False
+    
+    def _query_tracks(self, query, params=(), limit=None):
+        """Run a query on the tracks table and return up to limit existing files as dicts"""
+        self.wait_for_pending_writes()
+        
+        # Filter out files that no longer exist, using one directory scan
+        # instead of a stat() per track
+        with os.scandir(self.export_path) as entries:
+            existing = {entry.name for entry in entries if entry.is_file()}
+        
+        tracks = []
+        conn = self._connect()
+        try:
+            # The limit applies after the existence check, so missing files
+            # don't shrink the result; rows are read only until it's reached
+            for row in conn.execute(query, params):
+                metadata = {key: row[key] for key in row.keys() if row[key] is not None}
+                filepath = metadata['filepath']
+                if os.path.dirname(filepath) == self.export_path:
+                    exists = os.path.basename(filepath) in existing
+                else:
+                    exists = os.path.exists(filepath)
+                if exists:
+                    tracks.append(metadata)
+                    if limit is not None and len(tracks) >= limit:
+                        break
+        finally:
+            conn.close()
+        return tracks
     
     def load_music_library(self):
         """Load all generated music with metadata"""
         try:
-            if not os.path.exists(self.metadata_file):
-                return []
-            
-            with open(self.metadata_file, 'r') as f:
-                metadata_list = json.load(f)
-            
-            # Filter out files that no longer exist
-            valid_metadata = []
-            for metadata in metadata_list:
-                if os.path.exists(metadata['filepath']):
-                    valid_metadata.append(metadata)
-            
-            return valid_metadata
+            return self._query_tracks("SELECT * FROM tracks")
             
         except Exception as e:
             print(f"Error loading music library: {e}")
@@ -92,16 +196,15 @@ class ExportManager:
     def delete_music_file(self, filepath):
         """Delete music file and its metadata"""
         try:
+            self.wait_for_pending_writes()
+            
             # Delete file
             if os.path.exists(filepath):
                 os.remove(filepath)
             
             # Remove from metadata
-            all_metadata = self.load_music_library()
-            updated_metadata = [m for m in all_metadata if m['filepath'] != filepath]
-            
-            with open(self.metadata_file, 'w') as f:
-                json.dump(updated_metadata, f, indent=2)
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM tracks WHERE filepath = ?", (filepath,))
                 
             return True
             
@@ -111,8 +214,12 @@ class ExportManager:
     
     def get_recent_music(self, limit=10):
         """Get most recent generated music"""
-        all_music = self.load_music_library()
-        return sorted(all_music, key=lambda x: x['timestamp'], reverse=True)[:limit]
+        try:
+            return self._query_tracks("SELECT * FROM tracks ORDER BY timestamp DESC", limit=limit)
+            
+        except Exception as e:
+            print(f"Error loading recent music: {e}")
+            return []
     
     def export_playlist(self, selected_files, playlist_name):
         """Export selected files as a playlist"""
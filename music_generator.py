@@ -1,37 +1,330 @@
-from transformers import AutoProcessor, MusicgenForConditionalGeneration
-import scipy.io.wavfile
+# transformers is imported where it's used: it takes seconds to import and
+# isn't needed until a model loads
+from collections import OrderedDict
+from queue import Queue
 import numpy as np
 import torch
+import functools
+import importlib.util
+import threading
 import time
+import os
+
+# Resolved once at import so reruns don't query the CUDA runtime again
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Persist compiled kernels so later process starts skip the long compile
+INDUCTOR_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai-music-composer", "inductor")
+
+# Keywords appended to the prompt for each style
+STYLE_SUFFIXES = {
+    "jazz": ", jazz style, smooth, sophisticated, piano, saxophone",
+    "classical": ", classical music, orchestral, elegant, symphonic",
+    "electronic": ", electronic music, synthesizer, beats, modern",
+    "rock": ", rock music, guitar, drums, energetic",
+    "ambient": ", ambient music, atmospheric, peaceful, ethereal",
+    "pop": ", pop music, catchy, melodic, upbeat",
+    "blues": ", blues music, soulful, guitar, emotional",
+    "folk": ", folk music, acoustic, traditional, storytelling"
+}
+
+# Prompt token lengths are padded up to a multiple of this
+PROMPT_PAD_MULTIPLE = 16
+
+# Number of prompts whose text encoder outputs are kept for reuse
+PROMPT_CACHE_SIZE = 64
+
+# Number of tokenized prompts kept for reuse
+TOKEN_CACHE_SIZE = 256
+
+# Decoder steps used to trace the compiled decoder before the first real request
+WARMUP_TOKENS = 8
+
+
+class MusicgenStreamer:
+    """Streamer that decodes MusicGen tokens into audio chunks while generating"""
+    
+    # Implements the transformers BaseStreamer interface (put/end) without
+    # importing transformers at module load
+    
+    def __init__(self, model, play_steps=10, stride=None, timeout=None):
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.play_steps = play_steps
+        self.hop_length = int(np.prod(self.audio_encoder.config.upsampling_ratios))
+        
+        # Overlap between chunks so decoded audio joins up without clicks
+        if stride is None:
+            stride = self.hop_length * (play_steps - self.decoder.num_codebooks) // 6
+        self.stride = int(stride)
+        
+        # Frames decoded ahead of each new chunk so the audio decoder has
+        # context; only this trailing window is decoded, not the whole history
+        self.context_frames = play_steps
+        
+        # Trailing columns of the delayed token stream still needed for
+        # decoding, and the stream position of the first one
+        self.token_cache = None
+        self.cache_start = 0
+        self.to_yield = 0
+        self.audio_queue = Queue()
+        self.stop_signal = None
+        self.timeout = timeout
+    
+    def decode_frames(self, start, end):
+        """Undo the codebook delay pattern for frames [start, end) and decode them to audio"""
+        # Column 0 of the stream holds the decoder start token and codebook k
+        # is delayed by k steps, so frame f of codebook k sits at column f + k + 1
+        offset = start + 1 - self.cache_start
+        codes = torch.stack([
+            self.token_cache[k, offset + k:offset + k + end - start]
+            for k in range(self.decoder.num_codebooks)
+        ])
+        codes = codes[None, None].to(self.audio_encoder.device)
+        
+        output_values = self.audio_encoder.decode(codes, audio_scales=[None])
+        return output_values.audio_values[0, 0].cpu().float().numpy()
+    
+    def decode_tail(self):
+        """Decode the frames not yet yielded plus some context, returning (audio, offset)
+        
+        offset is where the not-yet-yielded audio starts in the returned array.
+        """
+        num_steps = self.cache_start + self.token_cache.shape[-1]
+        num_frames = num_steps - self.decoder.num_codebooks
+        start = max(self.to_yield // self.hop_length - self.context_frames, 0)
+        if num_frames <= start:
+            return np.zeros(0, dtype=np.float32), 0
+        
+        audio_values = self.decode_frames(start, num_frames)
+        return audio_values, self.to_yield - start * self.hop_length
+    
+    def put(self, value):
+        """Receive new tokens from generate() and emit audio every play_steps"""
+        if value.shape[0] // self.decoder.num_codebooks > 1:
+            raise ValueError("MusicgenStreamer only supports batch size 1")
+        
+        if self.token_cache is None:
+            self.token_cache = value
+        else:
+            self.token_cache = torch.concatenate([self.token_cache, value[:, None]], dim=-1)
+        
+        if (self.cache_start + self.token_cache.shape[-1]) % self.play_steps == 0:
+            audio_values, offset = self.decode_tail()
+            # Hold back the last stride samples for the next window to overlap;
+            # an explicit end index keeps stride 0 from slicing to nothing
+            end = len(audio_values) - self.stride
+            if end <= offset:
+                return
+            self.on_finalized_audio(audio_values[offset:end])
+            self.to_yield += end - offset
+            
+            # Drop the columns the next window no longer reaches
+            keep_from = max(self.to_yield // self.hop_length - self.context_frames, 0) + 1
+            if keep_from > self.cache_start:
+                self.token_cache = self.token_cache[:, keep_from - self.cache_start:]
+                self.cache_start = keep_from
+    
+    def end(self):
+        """Flush the remaining audio once generation has finished"""
+        if self.token_cache is not None:
+            audio_values, offset = self.decode_tail()
+        else:
+            audio_values, offset = np.zeros(0, dtype=np.float32), 0
+        self.on_finalized_audio(audio_values[offset:], stream_end=True)
+    
+    def on_finalized_audio(self, audio, stream_end=False):
+        """Put a decoded chunk on the queue for the consumer"""
+        self.audio_queue.put(audio, timeout=self.timeout)
+        if stream_end:
+            self.audio_queue.put(self.stop_signal, timeout=self.timeout)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        value = self.audio_queue.get(timeout=self.timeout)
+        if value is self.stop_signal:
+            raise StopIteration()
+        return value
 
 class MusicGenerator:
+    # Model state is shared by every instance so the weights load once per process
+    _model = None
+    _processor = None
+    # (model_size, dtype, quantization, compile_model) the current model was loaded with
+    _load_key = None
+    # Held while loading and while generating, so a model swap can't happen
+    # under an in-flight generation
+    _load_lock = threading.RLock()
+    _prompt_cache = OrderedDict()
+    _prompt_key = threading.local()
+    _tok_cache = OrderedDict()
+    
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.processor = None
-        self.model = None
-        self.model_loaded = False
+        self.device = DEVICE
         self.sample_rate = 32000
+    
+    @property
+    def model(self):
+        return type(self)._model
+    
+    @property
+    def processor(self):
+        return type(self)._processor
+    
+    @property
+    def model_loaded(self):
+        return type(self)._model is not None
         
-    def load_model(self, model_size="small"):
-        """Load the MusicGen model from Hugging Face"""
-        try:
-            print(f"Loading facebook/musicgen-{model_size}...")
+    def load_model(self, model_size="small", compile_model=False, dtype=None, quantization=None):
+        """Load the MusicGen model from Hugging Face, once per process"""
+        cls = type(self)
+        with cls._load_lock:
+            # Half precision halves the weight bytes read per decoding step
+            if dtype is None:
+                dtype = self.get_default_dtype()
             
-            self.processor = AutoProcessor.from_pretrained(f"facebook/musicgen-{model_size}")
-            self.model = MusicgenForConditionalGeneration.from_pretrained(f"facebook/musicgen-{model_size}")
+            # Any change of options reloads, rather than silently keeping the old model
+            load_key = (model_size, dtype, quantization, compile_model)
+            if cls._model is not None and cls._load_key == load_key:
+                return True
             
-            if self.device == "cuda":
-                self.model = self.model.to(self.device)
+            previous = (cls._processor, cls._model, cls._load_key)
+            try:
+                from transformers import AutoProcessor, MusicgenForConditionalGeneration
+                
+                print(f"Loading facebook/musicgen-{model_size}...")
+                
+                # Enable TF32 matmuls on Ampere for any remaining fp32 work
+                torch.set_float32_matmul_precision("high")
+                
+                load_kwargs = {
+                    "torch_dtype": dtype,
+                    "attn_implementation": self.get_attn_implementation(dtype)
+                }
+                if quantization is not None:
+                    # bitsandbytes places the weights itself, so no .to(device) afterwards
+                    load_kwargs["quantization_config"] = self.get_quantization_config(quantization, dtype)
+                    load_kwargs["device_map"] = "auto"
+                
+                processor = AutoProcessor.from_pretrained(f"facebook/musicgen-{model_size}")
+                model = MusicgenForConditionalGeneration.from_pretrained(
+                    f"facebook/musicgen-{model_size}", **load_kwargs
+                )
+                
+                if self.device == "cuda" and quantization is None:
+                    model = model.to(self.device)
+                model.eval()
+                
+                cls._processor = processor
+                cls._model = model
+                cls._load_key = load_key
+                cls._tok_cache.clear()
+                self._install_prompt_cache()
+                
+                # Opt-in: the KV cache grows every step, so the decoder's shapes
+                # change per token and CUDA graphs can't be reused across steps
+                if compile_model:
+                    self._compile_decoder()
+                
+                print("Model loaded successfully!")
+                return True
+                
+            except Exception as e:
+                # Keep serving the previous model rather than a half-set-up one
+                cls._processor, cls._model, cls._load_key = previous
+                cls._tok_cache.clear()
+                cls._prompt_cache.clear()
+                print(f"Error loading model: {e}")
+                return False
+    
+    def get_attn_implementation(self, dtype):
+        """Get the fused attention kernel to load the model with"""
+        # FlashAttention 2 needs Ampere or newer, half precision and the flash-attn package
+        if (
+            self.device == "cuda"
+            and dtype in (torch.float16, torch.bfloat16)
+            and torch.cuda.get_device_capability()[0] >= 8
+            and importlib.util.find_spec("flash_attn") is not None
+        ):
+            return "flash_attention_2"
+        return "sdpa"
+    
+    def get_quantization_config(self, quantization, compute_dtype):
+        """Get the bitsandbytes config for "int8" or "nf4" weight quantization"""
+        from transformers import BitsAndBytesConfig
+        
+        if self.device != "cuda":
+            raise ValueError("Weight quantization requires a CUDA device")
+        
+        # Output heads stay in half precision alongside norms and embeddings
+        skip_modules = ["lm_heads"]
+        if quantization == "int8":
+            return BitsAndBytesConfig(load_in_8bit=True, llm_int8_skip_modules=skip_modules)
+        if quantization == "nf4":
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=compute_dtype,
+                llm_int8_skip_modules=skip_modules
+            )
+        raise ValueError(f"Unknown quantization: {quantization}")
+    
+    def _install_prompt_cache(self):
+        """Memoize text encoder outputs so repeated prompts skip the T5 forward pass"""
+        self._prompt_cache.clear()
+        encoder_forward = self.model.text_encoder.forward
+        prompt_key = self._prompt_key
+        
+        # wraps() keeps T5's signature visible, so generate() still drops the
+        # kwargs the encoder doesn't accept (such as guidance_scale)
+        @functools.wraps(encoder_forward)
+        @torch.inference_mode()
+        def cached_forward(*args, **kwargs):
+            # _generate() sets the key to the prompt being encoded; hashing the
+            # token ids instead would need a device-to-host sync per call
+            key = getattr(prompt_key, "key", None)
+            if key is None:
+                return encoder_forward(*args, **kwargs)
             
-            self.model_loaded = True
-            print("Model loaded successfully!")
-            return True
+            if key in self._prompt_cache:
+                self._prompt_cache.move_to_end(key)
+                return self._prompt_cache[key]
             
-        except Exception as e:
-            print(f"Error loading model: {e}")
-            return False
+            outputs = encoder_forward(*args, **kwargs)
+            self._prompt_cache[key] = outputs
+            if len(self._prompt_cache) > PROMPT_CACHE_SIZE:
+                self._prompt_cache.popitem(last=False)
+            return outputs
+        
+        self.model.text_encoder.forward = cached_forward
     
-    def generate_music(self, prompt, duration=30, temperature=1.0, top_k=250):
+    def get_default_dtype(self):
+        """Get the weight dtype for the current device"""
+        if self.device != "cuda":
+            return torch.float32
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    
+    def _compile_decoder(self):
+        """Compile the decoder forward pass and warm it up"""
+        print("Compiling decoder (first run can take a minute)...")
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", INDUCTOR_CACHE_DIR)
+        
+        # Only the decoder runs once per token; the text encoder runs once per call.
+        # dynamic=True traces the growing cache length symbolically rather than
+        # recompiling for every step
+        self.model.decoder.forward = torch.compile(
+            self.model.decoder.forward, dynamic=True, fullgraph=False
+        )
+        
+        # Trigger compilation now rather than on the first user request
+        audio, message = self.generate_music("warmup", duration=WARMUP_TOKENS / 50)
+        if audio is None:
+            raise RuntimeError(message)
+    
+    def generate_music(self, prompt, duration=30, temperature=1.0, top_k=250, streamer=None, return_dtype="float32"):
         """Generate music from text prompt"""
         
         if not self.model_loaded:
@@ -41,63 +334,160 @@ class MusicGenerator:
         try:
             start_time = time.time()
             
-            # Calculate tokens for duration (roughly 50 tokens per second)
-            num_tokens = int(duration * 50)
-            
-            # Process the prompt
-            inputs = self.processor(
-                text=[prompt],
-                padding=True,
-                return_tensors="pt"
-            )
-            
-            if self.device == "cuda":
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
-            
-            # Generate audio with parameters
-            audio_values = self.model.generate(
-                **inputs, 
-                max_new_tokens=num_tokens,
-                temperature=temperature,
-                top_k=top_k,
-                do_sample=True
-            )
-            
-            # Convert to numpy array
-            audio_array = audio_values[0, 0].cpu().numpy()
+            with self._load_lock:
+                audio_arrays = self._generate(
+                    prompt, duration, temperature, top_k, streamer=streamer, return_dtype=return_dtype
+                )
             
             generation_time = time.time() - start_time
             
-            return audio_array, f"Generated in {generation_time:.2f} seconds"
+            return audio_arrays[0], f"Generated in {generation_time:.2f} seconds"
             
         except Exception as e:
             return None, f"Error generating music: {str(e)}"
     
-    def generate_with_style(self, prompt, style="general", duration=30, temperature=1.0, top_k=250):
+    def _generate(self, prompt, duration, temperature, top_k, num_variations=1, streamer=None, return_dtype="float32"):
+        """Run generate() for one prompt and return a (num_variations, samples) array"""
+        # Calculate tokens for duration (roughly 50 tokens per second)
+        num_tokens = int(duration * 50)
+        
+        # Each variation is its own batch row, since MusicGen's generate()
+        # doesn't expand num_return_sequences correctly across the codebook
+        # rows of its delay pattern
+        inputs = self._tokenize(prompt, num_variations)
+        
+        # Generate audio with parameters; variations decode together as a batch.
+        # inference_mode also drops the autograd version counters and view
+        # tracking no_grad keeps
+        with torch.inference_mode():
+            # The key lets the text encoder cache look outputs up by prompt
+            self._prompt_key.key = (prompt, num_variations)
+            try:
+                audio_values = self.model.generate(
+                    **inputs, 
+                    max_new_tokens=num_tokens,
+                    temperature=temperature,
+                    top_k=top_k,
+                    do_sample=True,
+                    streamer=streamer
+                )
+            finally:
+                self._prompt_key.key = None
+        
+            # Convert to numpy array
+            audio = audio_values[:, 0]
+            if return_dtype == "int16":
+                # Quantize on the device so only half the bytes cross to the host
+                audio = (audio.float().clamp(-1, 1) * 32767).to(torch.int16)
+            else:
+                audio = audio.float()
+            audio_arrays = self._to_host(audio)
+        
+        # Release activation memory held by the caching allocator
+        if self.device == "cuda":
+            del audio_values, audio
+            torch.cuda.empty_cache()
+        
+        return audio_arrays
+    
+    def _tokenize(self, prompt, num_variations=1):
+        """Tokenize a prompt onto the device, reusing earlier results for repeated prompts"""
+        key = (prompt, num_variations)
+        if key in self._tok_cache:
+            self._tok_cache.move_to_end(key)
+            return self._tok_cache[key]
+        
+        # Padding to a fixed multiple keeps the encoder length (and the
+        # decoder's cross-attention shapes) in a few buckets
+        inputs = self.processor(
+            text=[prompt] * num_variations,
+            padding=True,
+            pad_to_multiple_of=PROMPT_PAD_MULTIPLE,
+            return_tensors="pt"
+        ).to(self.device)
+        self._tok_cache[key] = inputs
+        if len(self._tok_cache) > TOKEN_CACHE_SIZE:
+            self._tok_cache.popitem(last=False)
+        return inputs
+    
+    def _to_host(self, audio):
+        """Copy generated audio to a numpy array backed by pinned host memory"""
+        if audio.device.type != "cuda":
+            return audio.numpy()
+        
+        # Pinned memory lets the copy DMA directly instead of staging through
+        # pageable memory; torch's host allocator recycles freed pinned blocks,
+        # so each call gets its own buffer without a fresh cudaHostAlloc
+        host = torch.empty(audio.shape, dtype=audio.dtype, pin_memory=True)
+        host.copy_(audio, non_blocking=True)
+        torch.cuda.current_stream().synchronize()
+        
+        # The array is a view of the pinned buffer, which lives as long as the caller holds it
+        return host.numpy()
+    
+    def generate_with_style(self, prompt, style="general", duration=30, temperature=1.0, top_k=250, streamer=None, return_dtype="float32"):
         """Generate music with specific style enhancement"""
         
-        style_prompts = {
-            "jazz": f"{prompt}, jazz style, smooth, sophisticated, piano, saxophone",
-            "classical": f"{prompt}, classical music, orchestral, elegant, symphonic",
-            "electronic": f"{prompt}, electronic music, synthesizer, beats, modern",
-            "rock": f"{prompt}, rock music, guitar, drums, energetic",
-            "ambient": f"{prompt}, ambient music, atmospheric, peaceful, ethereal",
-            "pop": f"{prompt}, pop music, catchy, melodic, upbeat",
-            "blues": f"{prompt}, blues music, soulful, guitar, emotional",
-            "folk": f"{prompt}, folk music, acoustic, traditional, storytelling"
-        }
-        
-        enhanced_prompt = style_prompts.get(style, prompt)
-        return self.generate_music(enhanced_prompt, duration, temperature, top_k)
-    
-    def generate_multiple(self, prompt, num_images=4, **kwargs):
+        suffix = STYLE_SUFFIXES.get(style)
+        enhanced_prompt = f"{prompt}{suffix}" if suffix else prompt
+        return self.generate_music(
+            enhanced_prompt, duration, temperature, top_k, streamer=streamer, return_dtype=return_dtype
+        )
+    
+    def generate_multiple(self, prompt, num_images=4, duration=30, temperature=1.0, top_k=250, return_dtype="float32"):
         """Generate multiple variations of the same prompt"""
-        results = []
-        for i in range(num_images):
-            audio, message = self.generate_music(prompt, **kwargs)
-            if audio is not None:
-                results.append(audio)
-        return results
+        if not self.model_loaded:
+            if not self.load_model():
+                return []
+        
+        try:
+            with self._load_lock:
+                audio_arrays = self._generate(
+                    prompt, duration, temperature, top_k, num_variations=num_images, return_dtype=return_dtype
+                )
+            return list(audio_arrays)
+            
+        except Exception as e:
+            print(f"Error generating music: {e}")
+            return []
+    
+    def generate_music_stream(self, prompt, duration=30, chunk_tokens=100, style="general", temperature=1.0, top_k=250):
+        """Generate music, yielding audio chunks as they are decoded
+        
+        Generation runs as one generate() call on a background thread, so the
+        KV cache carries across chunks. When exhausted, the generator returns
+        (audio_array, message) like generate_music via StopIteration.value.
+        """
+        streamer = self.create_streamer(play_steps=chunk_tokens)
+        if streamer is None:
+            return None, "Failed to load model"
+        
+        result = {}
+        
+        def worker():
+            result["audio"], result["message"] = self.generate_with_style(
+                prompt, style, duration, temperature, top_k, streamer=streamer
+            )
+            if result["audio"] is None:
+                # Unblock the consumer if generation failed before the stream ended
+                streamer.on_finalized_audio(np.zeros(0, dtype=np.float32), stream_end=True)
+        
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        
+        for chunk in streamer:
+            if chunk.size:
+                yield chunk
+        
+        thread.join()
+        return result["audio"], result["message"]
+    
+    def create_streamer(self, play_steps=10):
+        """Create a streamer that yields audio chunks during generation"""
+        if not self.model_loaded:
+            if not self.load_model():
+                return None
+        return MusicgenStreamer(self.model, play_steps=play_steps)
     
     def get_available_models(self):
         """Get list of available MusicGen models"""